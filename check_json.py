@@ -1,16 +1,29 @@
+import asyncio
+import functools
+import hashlib
 import json
+import math
 import os
+import re
+import sys
 import warnings
-from difflib import SequenceMatcher
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Optional, Dict, Set, Tuple
-
-import boto3
-import pandas as pd
+from pathlib import Path
+from typing import Optional, Dict, Iterable, Iterator, List, Tuple
+
+import aioboto3
+import numpy as np
+import openpyxl
+import polars as pl
+import xlrd
 from botocore.exceptions import ClientError
+from rapidfuzz.fuzz import ratio
+from rapidfuzz.process import cdist
 
 from config_campaignreporting.json_generator.prompts import rules, first_example, expected_response_1, second_example, \
-    expected_response_2, third_example, expected_response_3, new_request
+    expected_response_2, third_example, expected_response_3, new_request, new_request_batch, pair_request
 
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
@@ -25,17 +38,28 @@ class GptRoles(str, Enum):
 
 # Get the project directory (assuming the script is in the project directory or a subdirectory)
 project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-print(project_dir)
 
 # Construct the paths relative to the project directory
 jsons_path = os.path.join(project_dir, "reports/jsons")
 briefings_path = os.path.join(project_dir, "reports/briefing")
-print(briefings_path)
 shots_path = os.path.join(project_dir, "reports/shots")
+briefings_cache_path = os.path.join(project_dir, "reports/cache/briefings")
 
-s3_session = boto3.Session(profile_name="ESP-DEV")
-s3_client = s3_session.client("bedrock-runtime", region_name="us-east-1")
 model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+# Mark the static few-shot prefix as a Bedrock prompt-cache checkpoint. Off by
+# default: Bedrock rejects cache points for models without prompt-caching
+# support (such as the model above), so only enable it together with one that has it.
+prompt_caching = False
+# Output budget for a processed briefing. Kept at the model limit until output
+# lengths have been profiled; truncated briefings are flagged in the CHECK output.
+briefing_max_tokens = 4096
+briefing_inference_config = {"maxTokens": briefing_max_tokens, "temperature": 0.0}
+briefing_additional_fields = {"top_k": 250}
+
+# Concurrency limits for the Bedrock calls. The number of in-flight requests
+# should stay at or below the Bedrock TPS quota of the account to avoid throttling.
+max_concurrent_requests = 20
+batch_size = 4
 
 example_json_content = None
 
@@ -52,11 +76,45 @@ def load_example_json() -> None:
         with open(example_json_path, "r") as file:
             example_json_content = json.load(file)
 
-def process_excel_content(excel_content: Optional[str] = None) -> str:
+_USER_MESSAGE_TEMPLATE = """Process the following Excel content:\n\n{excel_content}, and create a JSON file with the results.
+                       The main body of the JSON should be 'briefing accion comercial'.
+                       Then, 'informacion general' should be a block containing 'Nombre de la acción Comercial', 'Producto', 'Abierto/Segmentada', 'Metadata Adobe Campaign', and so on.
+                       Do not translate the dictionary keys, keep the original names like 'Nombre de la acción Comercial' or 'Producto'.
+                       Clean the strings of the desired format such as '•' or '\\n'.
+                       When there are colons, such as in 'descripcion campaña', they should also be part of the JSON as key-value pairs.
+                       The 'n.a.' values should be null.
+                       Ensure that the dates are formatted as 'yyyy-mm-dd'.
+                       The structure should be similar to the following example, with different success and metric criteria based off the typology of the campaign:
+                       {example_json}
+                       The most important part is the "MEDICIONES" section in the Briefing, where the adobe input is shown, with the different success criteria if any and campaign typology.
+                       The descripcion campaña part is also important, where the promotional code is shown, as well as specific conditions such as amount of bills to be domiciled.
+                       """
+
+@functools.cache
+def get_user_message_template() -> str:
+    """
+    Return the briefing processing message with the example JSON already embedded.
+    The example is serialized only once; `{excel_content}` is left to be formatted per call.
+    ----------
+    Returns
+        The user message template.
+    """
+    load_example_json()
+    # Compact separators: indentation only adds billed tokens to every call.
+    example_json = json.dumps(example_json_content, separators=(",", ":"))
+    # Escape the JSON braces so they survive the per-call str.format.
+    example_json = example_json.replace("{", "{{").replace("}", "}}")
+    return _USER_MESSAGE_TEMPLATE.replace("{example_json}", example_json)
+
+async def process_excel_content(client, semaphore: asyncio.Semaphore, excel_content: Optional[str] = None) -> Tuple[str, str]:
     """
     Process the given Excel content and create a JSON file with the results.
     Parameters
     ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
     excel_content: str
         The Excel content to process.
 
@@ -64,22 +122,10 @@ def process_excel_content(excel_content: Optional[str] = None) -> str:
     -------
     clean_briefing
         The clean Excel file as a json string.
+    stop_reason
+        Why the model stopped; "max_tokens" means the briefing is truncated.
     """
-    load_example_json()
-
-    user_message = f"""Process the following Excel content:\n\n{excel_content}, and create a JSON file with the results.
-                       The main body of the JSON should be 'briefing accion comercial'.
-                       Then, 'informacion general' should be a block containing 'Nombre de la acción Comercial', 'Producto', 'Abierto/Segmentada', 'Metadata Adobe Campaign', and so on.
-                       Do not translate the dictionary keys, keep the original names like 'Nombre de la acción Comercial' or 'Producto'.
-                       Clean the strings of the desired format such as '•' or '\\n'.
-                       When there are colons, such as in 'descripcion campaña', they should also be part of the JSON as key-value pairs.
-                       The 'n.a.' values should be null.
-                       Ensure that the dates are formatted as 'yyyy-mm-dd'.
-                       The structure should be similar to the following example, with different success and metric criteria based off the typology of the campaign:
-                       {json.dumps(example_json_content, indent=2)}
-                       The most important part is the "MEDICIONES" section in the Briefing, where the adobe input is shown, with the different success criteria if any and campaign typology.
-                       The descripcion campaña part is also important, where the promotional code is shown, as well as specific conditions such as amount of bills to be domiciled.
-                       """
+    user_message = get_user_message_template().format(excel_content=excel_content)
     conversation = [
         {
             "role": GptRoles.USER,
@@ -88,20 +134,146 @@ def process_excel_content(excel_content: Optional[str] = None) -> str:
     ]
 
     try:
-        response = s3_client.converse(
-            modelId=model_id,
-            messages=conversation,
-            inferenceConfig={"maxTokens": 4096, "temperature": 0.01},
-            additionalModelRequestFields={"top_k": 250},
-        )
+        async with semaphore:
+            response = await client.converse(
+                modelId=model_id,
+                messages=conversation,
+                inferenceConfig=briefing_inference_config,
+                additionalModelRequestFields=briefing_additional_fields,
+            )
 
         clean_briefing = response["output"]["message"]["content"][0]["text"].rstrip()
+        stop_reason = response.get("stopReason", "")
 
     except (ClientError, Exception) as e:
         print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
         exit(1)
 
-    return clean_briefing
+    return clean_briefing, stop_reason
+
+# Bump whenever read_excel_as_text changes its output, so cached briefings
+# converted from the old text are not reused.
+excel_text_version = "calamine-tsv-1"
+
+def read_excel_as_text(excel_path: str) -> str:
+    """
+    Dump the first sheet of an Excel file as tab-separated text.
+    The sheet is parsed with the calamine (Rust) engine, without building a pandas DataFrame.
+    Parameters
+    ----------
+    excel_path: str
+        Path to the Excel file to read.
+
+    Returns
+    -------
+    excel_content
+        One line per row with the cell values separated by tabs.
+    """
+    return pl.read_excel(excel_path, engine="calamine", has_header=False).write_csv(separator="\t")
+
+# In-process cache of processed briefings, keyed on briefing_cache_key.
+briefings_cache: Dict[str, str] = {}
+
+def briefing_cache_key(excel_path: str) -> str:
+    """
+    Return the cache key of the processed briefing of an Excel file.
+    It hashes everything the conversion depends on: the workbook bytes, the model,
+    its inference settings, the processing prompt and the text dump version.
+    Parameters
+    ----------
+    excel_path: str
+        Path to the Excel file to process.
+
+    Returns
+    -------
+    digest
+        Hex SHA-256 digest identifying the conversion.
+    """
+    settings = {
+        "model_id": model_id,
+        "inference_config": briefing_inference_config,
+        "additional_fields": briefing_additional_fields,
+        "excel_text_version": excel_text_version,
+        "user_message_template": get_user_message_template(),
+    }
+    sha256 = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    with open(excel_path, "rb") as file:
+        sha256.update(file.read())
+    return sha256.hexdigest()
+
+def read_cached_briefing(cache_file: str) -> Optional[str]:
+    """
+    Read a processed briefing from the disk cache.
+    Parameters
+    ----------
+    cache_file: str
+        Path of the cache entry.
+
+    Returns
+    -------
+    clean_briefing
+        The cached briefing, or None when there is no entry.
+    """
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, "r", encoding="utf-8") as file:
+        return file.read()
+
+def write_cached_briefing(cache_file: str, clean_briefing: str) -> None:
+    """
+    Store a processed briefing in the disk cache.
+    Parameters
+    ----------
+    cache_file: str
+        Path of the cache entry.
+    clean_briefing: str
+        The clean Excel file as a json string.
+    """
+    os.makedirs(briefings_cache_path, exist_ok=True)
+    with open(cache_file, "w", encoding="utf-8") as file:
+        file.write(clean_briefing)
+
+async def process_excel_file(client, semaphore: asyncio.Semaphore, excel_path: str) -> Tuple[str, bool]:
+    """
+    Process the given Excel file, reusing earlier results for identical workbooks.
+    Results are cached in memory and under `briefings_cache_path`, keyed on
+    `briefing_cache_key`, so unchanged briefings never reach Bedrock twice for
+    the same model, prompt and settings.
+    Parameters
+    ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
+    excel_path: str
+        Path to the Excel file to process.
+
+    Returns
+    -------
+    clean_briefing
+        The clean Excel file as a json string.
+    truncated
+        True when the conversion hit `briefing_max_tokens` and is incomplete.
+    """
+    digest = await asyncio.to_thread(briefing_cache_key, excel_path)
+
+    if digest in briefings_cache:
+        return briefings_cache[digest], False
+
+    cache_file = os.path.join(briefings_cache_path, f"{digest}.json")
+    clean_briefing = await asyncio.to_thread(read_cached_briefing, cache_file)
+    if clean_briefing is None:
+        excel_content = await asyncio.to_thread(read_excel_as_text, excel_path)
+        clean_briefing, stop_reason = await process_excel_content(client, semaphore, excel_content=excel_content)
+        if stop_reason == "max_tokens":
+            # Never cache a truncated briefing: it would be served on every rerun.
+            print(f"WARNING: processed briefing of {os.path.basename(excel_path)} truncated at "
+                  f"{briefing_max_tokens} tokens; it is not cached.")
+            return clean_briefing, True
+        await asyncio.to_thread(write_cached_briefing, cache_file, clean_briefing)
+
+    briefings_cache[digest] = clean_briefing
+    return clean_briefing, False
 
 
 def list_excel_files_path(directory: str) -> list:
@@ -118,28 +290,114 @@ def list_excel_files_path(directory: str) -> list:
     list
         A list of paths to the Excel files found in the directory.
     """
-    excel_files_path = [
-        os.path.join(directory, f)
-        for f in os.listdir(directory)
-        if f.endswith(".xlsx") or f.endswith(".xls")
-    ]
+    with os.scandir(directory) as entries:
+        excel_files_path = [
+            entry.path
+            for entry in entries
+            if entry.is_file() and entry.name.endswith((".xlsx", ".xls"))
+        ]
     return excel_files_path
 
-all_briefings = list_excel_files_path(briefings_path)
+def normalize_description(description: str, max_length: int = 120) -> str:
+    """
+    Normalize a description before fuzzy matching.
+    Descriptions are capped so a malformed file cannot blow up the comparison cost.
 
-excels_descriptions = {}
+    Parameters
+    ----------
+    description : str
+        Raw description extracted from a briefing or JSON file.
+    max_length : int, optional
+        Maximum number of characters kept (default is 120).
 
-for excel_file in all_briefings:
-    excel_df = pd.read_excel(excel_file)
-    action_name = str(excel_df["Unnamed: 7"].iloc[5])
-    if isinstance(action_name, str):
-        start = action_name.find(') ') + 1
-        excels_descriptions[excel_file] = action_name[start:].strip().replace("/", "").replace("  ", " ")
+    Returns
+    -------
+    str
+        The stripped, length-capped and casefolded description.
+    """
+    return sys.intern(description.strip()[:max_length].casefold())
+
+def iter_sheet_rows(excel_file: str) -> Iterator[tuple]:
+    """
+    Stream the rows of the first sheet of an Excel file as tuples of cell values.
+    `.xlsx` files are read with openpyxl in read-only mode and legacy `.xls`
+    files with xlrd, the reader pandas used for them.
+
+    Parameters
+    ----------
+    excel_file : str
+        Path to the Excel file.
+
+    Returns
+    -------
+    Iterator[tuple]
+        The cell values of every row, starting at column A.
+    """
+    if excel_file.endswith(".xls"):
+        workbook = xlrd.open_workbook(excel_file, on_demand=True)
+        try:
+            sheet = workbook.sheet_by_index(0)
+            for row_index in range(sheet.nrows):
+                yield tuple(sheet.row_values(row_index))
+        finally:
+            workbook.release_resources()
     else:
-        excels_descriptions[excel_file] = "Invalid description"
-        print("BAD EXCEL DESCRIPTION")
+        workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+def find_action_name(rows: Iterable[tuple]) -> Optional[object]:
+    """
+    Locate the action name the way `pd.read_excel(...)["Unnamed: 7"].iloc[5]` did.
+    Fully blank rows are skipped, the first remaining row is the header and the
+    value sits in the sixth data row, eighth column.
+
+    Parameters
+    ----------
+    rows : Iterable[tuple]
+        Cell values of the sheet, row by row.
 
-print(len(excels_descriptions),"briefing files gathered")
+    Returns
+    -------
+    Optional[object]
+        The action name cell value, or None when it is missing or empty.
+    """
+    non_blank_rows = (row for row in rows if any(value not in (None, "") for value in row))
+    # Header row plus data rows 0..5.
+    for row_number, row in enumerate(non_blank_rows):
+        if row_number == 6:
+            value = row[7] if len(row) > 7 else None
+            return None if value in (None, "") else value
+    return None
+
+def extract_action_name(excel_file: str) -> Tuple[str, str]:
+    """
+    Extract the action name (description) of a briefing.
+
+    Parameters
+    ----------
+    excel_file : str
+        Path to the briefing Excel file.
+
+    Returns
+    -------
+    Tuple[str, str]
+        The given path and the description found in the briefing.
+    """
+    try:
+        # Rows are streamed and reading stops once the action name row is reached.
+        action_name = find_action_name(iter_sheet_rows(excel_file))
+    except Exception as e:
+        print(f"BAD EXCEL FILE {os.path.basename(excel_file)}: {e}")
+        action_name = None
+    if action_name is not None:
+        action_name = str(action_name)
+        start = action_name.find(') ') + 1
+        return excel_file, normalize_description(action_name[start:].strip().replace("/", "").replace("  ", " "))
+    print("BAD EXCEL DESCRIPTION")
+    return excel_file, "Invalid description"
 
 def list_json_file_paths(directory: str) -> list:
     """
@@ -155,27 +413,47 @@ def list_json_file_paths(directory: str) -> list:
     list
         A list of paths to the JSON files found in the directory.
     """
-    json_paths = [
-        os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".json")
-    ]
+    with os.scandir(directory) as entries:
+        json_paths = [
+            entry.path for entry in entries if entry.is_file() and entry.name.endswith(".json")
+        ]
     return json_paths
 
-all_json_paths = list_json_file_paths(jsons_path)
+# Text between the first ") " and the next '",'; the last 5 characters of it
+# are not part of the description. Matched on raw bytes to skip decoding the file.
+_JSON_DESC_RE = re.compile(rb'\) (.*?)",', re.DOTALL)
+# The description sits at the top of the reference JSONs, so only this many
+# bytes are read unless the pattern is not found in them.
+_JSON_DESC_HEAD_SIZE = 2048
+
+def load_json_description(json_file: str) -> Tuple[str, str]:
+    """
+    Extract the description of a reference JSON file.
 
-json_descriptions = {}
-for json_file in all_json_paths:
-    with open(json_file, "r") as file:
-        json_string = file.read()
-    start = json_string.find(') ') + 2
-    end = json_string.find('",', start) - 5
-    description = json_string[start:end].strip().strip('"')
-    json_descriptions[json_file] = description
+    Parameters
+    ----------
+    json_file : str
+        Path to the JSON file.
 
-print(len(json_descriptions),"json files gathered")
+    Returns
+    -------
+    Tuple[str, str]
+        The given path and the description found in the file.
+    """
+    with open(json_file, "rb") as file:
+        data = file.read(_JSON_DESC_HEAD_SIZE)
+        match = _JSON_DESC_RE.search(data)
+        if match is None:
+            data += file.read()
+            match = _JSON_DESC_RE.search(data)
+    if match is None:
+        return json_file, ""
+    description = match.group(1).decode("utf-8")[:-5]
+    return json_file, normalize_description(description.strip().strip('"'))
 
 def match_descriptions(
     json_dict: Dict[str, str], excel_dict: Dict[str, str], threshold: float = 0.93
-) -> Set[Tuple[str, str, str]]:
+) -> pl.DataFrame:
     """
     Match descriptions between JSON and Excel dictionaries based on a similarity threshold.
 
@@ -190,21 +468,69 @@ def match_descriptions(
 
     Returns
     -------
-    Set[Tuple[str, str, str]]
-        A set of tuples containing matched JSON file path, Excel file path, and the matched description.
+    pl.DataFrame
+        One row per match with the columns `json_path`, `excel_path`, `json_desc` and `excel_desc`.
     """
-    matches = set()
-    for json_file, json_desc in json_dict.items():
-        for excel_file, excel_desc in excel_dict.items():
-            similarity = SequenceMatcher(None, str(json_desc), str(excel_desc)).ratio()
-            if similarity >= threshold:
-                matches.add((json_file, excel_file, json_desc, excel_desc))
-    return matches
+    json_matches: List[str] = []
+    excel_matches: List[str] = []
+
+    def to_frame() -> pl.DataFrame:
+        return pl.DataFrame(
+            {
+                "json_path": json_matches,
+                "excel_path": excel_matches,
+                "json_desc": [json_dict[f] for f in json_matches],
+                "excel_desc": [excel_dict[f] for f in excel_matches],
+            },
+            schema={column: pl.Utf8 for column in ("json_path", "excel_path", "json_desc", "excel_desc")},
+        )
 
-matches = match_descriptions(json_descriptions, excels_descriptions)
-print(len(matches),"description matches:")
-for match in matches:
-    print("JSON:",match[2], "vs Excel:", match[3])
+    if not json_dict or not excel_dict:
+        return to_frame()
+
+    if threshold >= 1.0:
+        # Only identical descriptions can match: a hash lookup is enough.
+        excel_by_desc: Dict[str, list] = {}
+        for excel_file, excel_desc in excel_dict.items():
+            excel_by_desc.setdefault(str(excel_desc), []).append(excel_file)
+        for json_file, json_desc in json_dict.items():
+            for excel_file in excel_by_desc.get(str(json_desc), []):
+                json_matches.append(json_file)
+                excel_matches.append(excel_file)
+        return to_frame()
+
+    # Block candidates by length: a ratio of at least `threshold` is only
+    # possible when 2 * min(len_a, len_b) / (len_a + len_b) >= threshold, so
+    # each JSON length only needs the Excel lengths inside that window.
+    json_by_length = defaultdict(list)
+    for json_file, json_desc in json_dict.items():
+        json_by_length[len(str(json_desc))].append(json_file)
+    excel_by_length = defaultdict(list)
+    for excel_file, excel_desc in excel_dict.items():
+        excel_by_length[len(str(excel_desc))].append(excel_file)
+
+    for length, json_files in json_by_length.items():
+        # Widened by one on each side to absorb float rounding; cdist still
+        # applies the exact cutoff.
+        low = math.ceil(length * threshold / (2 - threshold)) - 1
+        high = math.floor(length * (2 - threshold) / threshold) + 1
+        excel_files = [f for l in range(max(low, 0), high + 1) for f in excel_by_length.get(l, [])]
+        if not excel_files:
+            continue
+
+        # score_cutoff lets RapidFuzz discard pairs whose length difference alone
+        # keeps them under the threshold before running the full alignment.
+        similarity = cdist(
+            [str(json_dict[f]) for f in json_files],
+            [str(excel_dict[f]) for f in excel_files],
+            scorer=ratio,
+            score_cutoff=threshold * 100,
+            workers=-1,
+        ) / 100.0
+        rows, cols = np.where(similarity >= threshold)
+        json_matches.extend(json_files[row] for row in rows)
+        excel_matches.extend(excel_files[col] for col in cols)
+    return to_frame()
 
 def transform_string_to_prompt(text: str, role: GptRoles = GptRoles.USER) -> list:
     """
@@ -229,43 +555,75 @@ def transform_string_to_prompt(text: str, role: GptRoles = GptRoles.USER) -> lis
     ]
     return conversation
 
-example_jsons_path_list = list_json_file_paths(shots_path)
-example_jsons = {}
+claude_prompt = None
+
+async def get_claude_prompt(client, semaphore: asyncio.Semaphore) -> list:
+    """
+    Build the few-shot comparison prompt (rules and the three examples) once.
+    The example briefings need Bedrock calls, so this only happens on first use.
+    Parameters
+    ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
+
+    Returns
+    -------
+        List containing the prompt messages (context) to send to the model.
+    """
+    global claude_prompt
+    if claude_prompt is not None:
+        return claude_prompt
+
+    example_jsons_path_list = list_json_file_paths(shots_path)
+    example_jsons = {}
 
-for json_file in example_jsons_path_list:
-    with open(json_file, "r") as file:
-        json_string = file.read()
-    example_jsons[json_file] = json_string
+    for json_file in example_jsons_path_list:
+        example_jsons[json_file] = Path(json_file).read_text(encoding="utf-8")
 
-example_briefings_path_list = list_excel_files_path(shots_path)
-example_excels = {}
-for brf_n in [0,1,2]:
-    example_briefing_path = os.path.join(shots_path, f"example_brf_{brf_n + 1}.xlsx")
-    example_briefing_str = pd.read_excel(example_briefing_path,sheet_name=0).to_string()
-    clean_example_briefing = process_excel_content(excel_content=example_briefing_str)
-    example_excels[brf_n] = clean_example_briefing
+    example_briefing_paths = [os.path.join(shots_path, f"example_brf_{brf_n + 1}.xlsx") for brf_n in [0,1,2]]
+    # Processed concurrently; process_excel_file persists the results, so later
+    # runs read them from the briefings cache instead of calling Bedrock.
+    example_results = await asyncio.gather(*(process_excel_file(client, semaphore, path) for path in example_briefing_paths))
+    example_excels = {n: clean_briefing for n, (clean_briefing, _) in enumerate(example_results)}
 
-example_jsons_list = list(example_jsons.values())
-example_briefings_list = list(example_excels.values())
+    example_jsons_list = list(example_jsons.values())
+    example_briefings_list = list(example_excels.values())
 
-claude_prompt = []
-claude_prompt.extend(transform_string_to_prompt(rules, GptRoles.USER))
+    prompt = []
+    prompt.extend(transform_string_to_prompt(rules, GptRoles.USER))
 
-claude_prompt.extend(transform_string_to_prompt(first_example.format(json_1 = example_jsons_list[0], brf_1 = example_briefings_list[0]), GptRoles.USER))
-claude_prompt.extend(transform_string_to_prompt(expected_response_1, GptRoles.ASSISTANT))
+    prompt.extend(transform_string_to_prompt(first_example.format(json_1 = example_jsons_list[0], brf_1 = example_briefings_list[0]), GptRoles.USER))
+    prompt.extend(transform_string_to_prompt(expected_response_1, GptRoles.ASSISTANT))
 
-claude_prompt.extend(transform_string_to_prompt(second_example.format(json_2 = example_jsons_list[1], brf_2 = example_briefings_list[1]), GptRoles.USER))
-claude_prompt.extend(transform_string_to_prompt(expected_response_2, GptRoles.ASSISTANT))
+    prompt.extend(transform_string_to_prompt(second_example.format(json_2 = example_jsons_list[1], brf_2 = example_briefings_list[1]), GptRoles.USER))
+    prompt.extend(transform_string_to_prompt(expected_response_2, GptRoles.ASSISTANT))
 
-claude_prompt.extend(transform_string_to_prompt(third_example.format(json_3 = example_jsons_list[2], brf_3 = example_briefings_list[2]), GptRoles.USER))
-claude_prompt.extend(transform_string_to_prompt(expected_response_3, GptRoles.ASSISTANT))
+    prompt.extend(transform_string_to_prompt(third_example.format(json_3 = example_jsons_list[2], brf_3 = example_briefings_list[2]), GptRoles.USER))
+    prompt.extend(transform_string_to_prompt(expected_response_3, GptRoles.ASSISTANT))
 
-def compare_json_excel(clean_briefing: str, json_path: str, prompt: list, new_request: str) -> str:
+    # Everything up to here is identical for every comparison; the cache point
+    # lets Bedrock reuse it so only the per-request message is processed anew.
+    if prompt_caching:
+        prompt[-1]["content"].append({"cachePoint": {"type": "default"}})
+
+    claude_prompt = prompt
+    return claude_prompt
+
+async def compare_json_excel(client, semaphore: asyncio.Semaphore, clean_briefing: str, json_path: str, prompt: list, new_request: str) -> str:
     """
     Compares json and excel (Briefing) files in the given directory.
 
     Parameters
     ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
+
     clean_briefing: str
         The clean Excel file as a json string.
 
@@ -283,20 +641,24 @@ def compare_json_excel(clean_briefing: str, json_path: str, prompt: list, new_re
     diff
         Text pointing out the differences between both json and briefing.
     """
-    with open(json_path, "r") as file:
-        json_content = file.read()
+    json_content = await asyncio.to_thread(Path(json_path).read_text, encoding="utf-8")
 
+    # Work on a copy: the shared few-shot prompt is used by concurrent requests.
+    prompt = list(prompt)
     prompt.extend(transform_string_to_prompt(new_request.format(clean_briefing=clean_briefing, json=json_content), GptRoles.USER))
 
     try:
-        response = s3_client.converse(
-            modelId=model_id,
-            messages=prompt,
-            inferenceConfig={"maxTokens": 4096, "temperature": 0.1},
-            additionalModelRequestFields={"top_k": 250},
-        )
+        async with semaphore:
+            response = await client.converse(
+                modelId=model_id,
+                messages=prompt,
+                inferenceConfig={"maxTokens": 4096, "temperature": 0.1},
+                additionalModelRequestFields={"top_k": 250},
+            )
 
         diff = response["output"]["message"]["content"][0]["text"].rstrip()
+        if response.get("stopReason") == "max_tokens":
+            diff += "\n- 🔴 TRUNCATED: the answer hit the token limit, this discrepancy list is incomplete."
 
     except (ClientError, Exception) as e:
         print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
@@ -304,11 +666,165 @@ def compare_json_excel(clean_briefing: str, json_path: str, prompt: list, new_re
 
     return diff
 
-for match in matches:
-    excel_str = pd.read_excel(match[1]).to_string()
-    clean_briefing = process_excel_content(excel_content=excel_str)
-    discrepancies = compare_json_excel(clean_briefing, match[0], prompt = claude_prompt, new_request = new_request)
-    json_filename = os.path.basename(match[0])
-    excel_filename = os.path.basename(match[1])
-    print(f"############################ CHECK ############################\n",
-          f"Discrepancies for {json_filename} and {excel_filename}:\n{discrepancies}")
+_PAIR_HEADER_RE = re.compile(r"^##\s*PAIR\s+(\d+)\s*$", re.MULTILINE)
+
+async def compare_json_excel_batch(client, semaphore: asyncio.Semaphore, pairs: List[Tuple[str, str]], prompt: list, new_request_batch: str) -> List[str]:
+    """
+    Compares several json and excel (Briefing) pairs with a single model call.
+
+    Parameters
+    ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
+
+    pairs: List[Tuple[str, str]]
+        Clean Excel file as a json string and path of its JSON file, per pair.
+
+    prompt: list
+        List containing the prompt messages (context) to send to the model.
+
+    new_request_batch : str
+        The batched request template to send to the model.
+
+    Returns
+    -------
+    diffs
+        Text pointing out the differences of every pair, in the same order as `pairs`.
+        When the answer hits the token limit the batch is split in halves and retried.
+    """
+    if len(pairs) == 1:
+        # A single pair needs no PAIR sections: use the plain comparison request.
+        clean_briefing, json_path = pairs[0]
+        return [await compare_json_excel(client, semaphore, clean_briefing, json_path, prompt = prompt, new_request = new_request)]
+
+    json_contents = await asyncio.gather(
+        *(asyncio.to_thread(Path(json_path).read_text, encoding="utf-8") for _, json_path in pairs)
+    )
+    pair_blocks = [
+        pair_request.format(index=index, clean_briefing=clean_briefing, json=json_content)
+        for index, ((clean_briefing, _), json_content) in enumerate(zip(pairs, json_contents), start=1)
+    ]
+
+    # Keep `prompt` untouched: a retry after truncation needs the bare prefix.
+    request_prompt = list(prompt)
+    request_prompt.extend(transform_string_to_prompt(new_request_batch.format(pairs="".join(pair_blocks)), GptRoles.USER))
+
+    try:
+        async with semaphore:
+            response = await client.converse(
+                modelId=model_id,
+                messages=request_prompt,
+                inferenceConfig={"maxTokens": 4096, "temperature": 0.1},
+                additionalModelRequestFields={"top_k": 250},
+            )
+
+        answer = response["output"]["message"]["content"][0]["text"].rstrip()
+        stop_reason = response.get("stopReason")
+
+    except (ClientError, Exception) as e:
+        print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
+        exit(1)
+
+    if stop_reason == "max_tokens":
+        # The last sections are cut off or missing; retry with smaller batches.
+        half = len(pairs) // 2
+        first, second = await asyncio.gather(
+            compare_json_excel_batch(client, semaphore, pairs[:half], prompt, new_request_batch),
+            compare_json_excel_batch(client, semaphore, pairs[half:], prompt, new_request_batch),
+        )
+        return first + second
+
+    # re.split yields [preamble, index_1, section_1, index_2, section_2, ...]
+    sections = _PAIR_HEADER_RE.split(answer)
+    diffs_by_index = {int(index): section.strip() for index, section in zip(sections[1::2], sections[2::2])}
+    return [
+        diffs_by_index.get(index, "ERROR: the model returned no answer for this pair.")
+        for index in range(1, len(pairs) + 1)
+    ]
+
+async def check_batch(
+    client, semaphore: asyncio.Semaphore, batch: List[Tuple[str, str, str, str]], briefings: Dict[str, str], prompt: list
+) -> List[Tuple[Tuple[str, str, str, str], str]]:
+    """
+    Compare the processed briefings of a batch of matches against their JSONs.
+
+    Parameters
+    ----------
+    client
+        The bedrock-runtime client used to invoke the model.
+    semaphore: asyncio.Semaphore
+        Semaphore bounding the in-flight Bedrock requests.
+    batch: List[Tuple[str, str, str, str]]
+        Matches made of JSON file path, Excel file path and their descriptions.
+    briefings: Dict[str, str]
+        Clean briefing (json string) of every matched Excel file path.
+    prompt: list
+        List containing the prompt messages (context) to send to the model.
+
+    Returns
+    -------
+    List[Tuple[Tuple[str, str, str, str], str]]
+        Every match of the batch with the discrepancies found for it.
+    """
+    pairs = [(briefings[match[1]], match[0]) for match in batch]
+    discrepancies = await compare_json_excel_batch(client, semaphore, pairs, prompt = prompt, new_request_batch = new_request_batch)
+    return list(zip(batch, discrepancies))
+
+async def main() -> None:
+    """
+    Match the reference JSONs with their briefings and print the discrepancies of every match.
+    """
+    print(project_dir)
+    print(briefings_path)
+
+    all_briefings = list_excel_files_path(briefings_path)
+    all_json_paths = list_json_file_paths(jsons_path)
+
+    # Both extractions are file I/O and parsing bound, so they share one pool.
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        excel_results = executor.map(extract_action_name, all_briefings)
+        json_results = executor.map(load_json_description, all_json_paths)
+        excels_descriptions = dict(excel_results)
+        json_descriptions = dict(json_results)
+
+    print(len(excels_descriptions),"briefing files gathered")
+    print(len(json_descriptions),"json files gathered")
+
+    matches = match_descriptions(json_descriptions, excels_descriptions)
+    print(len(matches),"description matches:")
+    for json_desc, excel_desc in matches.select("json_desc", "excel_desc").iter_rows():
+        print("JSON:",json_desc, "vs Excel:", excel_desc)
+
+    matches_list = list(matches.iter_rows())
+    batches = [matches_list[i:i + batch_size] for i in range(0, len(matches_list), batch_size)]
+
+    # Created here so it belongs to the event loop running this pipeline.
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    session = aioboto3.Session(profile_name="ESP-DEV")
+    async with session.client("bedrock-runtime", region_name="us-east-1") as client:
+        # Built before the comparisons start so the examples are only processed once.
+        claude_prompt = await get_claude_prompt(client, semaphore)
+
+        # An Excel file can match several JSONs; process each file only once.
+        unique_excels = matches["excel_path"].unique().to_list()
+        results = await asyncio.gather(*(process_excel_file(client, semaphore, path) for path in unique_excels))
+        briefings = {path: clean_briefing for path, (clean_briefing, _) in zip(unique_excels, results)}
+        truncated_excels = {path for path, (_, truncated) in zip(unique_excels, results) if truncated}
+
+        tasks = [check_batch(client, semaphore, batch, briefings, claude_prompt) for batch in batches]
+        for future in asyncio.as_completed(tasks):
+            for match, discrepancies in await future:
+                json_filename = os.path.basename(match[0])
+                excel_filename = os.path.basename(match[1])
+                if match[1] in truncated_excels:
+                    discrepancies = (f"- 🔴 TRUNCATED BRIEFING: the processed briefing hit {briefing_max_tokens} tokens, "
+                                     f"these discrepancies are not reliable.\n{discrepancies}")
+                print(f"############################ CHECK ############################\n",
+                      f"Discrepancies for {json_filename} and {excel_filename}:\n{discrepancies}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
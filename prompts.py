@@ -19,6 +19,9 @@ clear.
   shows the ideal assistant answer.
 - **new_request**: template used in production – placeholders
   `{clean_briefing}` and `{json}` will be filled at runtime.
+- **new_request_batch**: production template comparing several pairs in
+  a single call – `{pairs}` is filled with one **pair_request** per pair
+  (placeholders `{index}`, `{clean_briefing}` and `{json}`).
 
 The comparison logic focuses on the **most business‑critical sections**:
   * Start / end dates of the commercial activity.
@@ -137,3 +140,26 @@ Please compare the two JSON documents below.  Use the **RULES** and return
 ================  🟢  REFERENCE JSON  =================
 {json}
 """
+
+# Batched variant: several briefing/reference pairs share one call so the
+# few-shot prefix is only sent once.  Each pair is rendered with
+# `pair_request` and the answers come back under `## PAIR <index>` headers.
+
+pair_request: str = """
+### PAIR {index}
+BRIEFING:
+{clean_briefing}
+REFERENCE:
+{json}
+"""
+
+new_request_batch: str = """
+Please compare each of the numbered pairs below independently.  In every
+pair, BRIEFING is the 🟠 briefing JSON and REFERENCE is the 🟢 reference
+JSON.  Use the **RULES** for each pair.
+
+Answer with one section per pair, in the same order, starting each section
+with a header line `## PAIR <number>` followed by `NO_DIFF` or the bullet
+list of discrepancies for that pair.  Keep every section under 1000 tokens.
+{pairs}
+"""
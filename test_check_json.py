@@ -0,0 +1,70 @@
+import asyncio
+
+from config_campaignreporting.json_generator import check_json
+
+
+class FakeBedrockClient:
+    """
+    Stand-in for the async bedrock-runtime client: records every request and
+    truncates any batch with more than two pairs.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    async def converse(self, **kwargs):
+        self.calls.append(kwargs["messages"])
+        request = kwargs["messages"][-1]["content"][0]["text"]
+        n_pairs = request.count("### PAIR")
+        if n_pairs > 2:
+            return {"output": {"message": {"content": [{"text": "## PAIR 1\nNO_DIFF\n## PAIR 2\n- cut"}]}},
+                    "stopReason": "max_tokens"}
+        answer = "\n".join(f"## PAIR {i}\n- diff {i}" for i in range(1, n_pairs + 1)) or "NO_DIFF"
+        return {"output": {"message": {"content": [{"text": answer}]}}, "stopReason": "end_turn"}
+
+
+def make_prompt():
+    return [
+        {"role": "user", "content": [{"text": "rules"}]},
+        {"role": "assistant", "content": [{"text": "NO_DIFF"}]},
+    ]
+
+
+def make_pairs(tmp_path, n):
+    pairs = []
+    for i in range(n):
+        json_path = tmp_path / f"ref_{i}.json"
+        json_path.write_text(f'{{"id": {i}}}', encoding="utf-8")
+        pairs.append((f"briefing {i}", str(json_path)))
+    return pairs
+
+
+def run_batch(client, pairs, prompt):
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+        return await check_json.compare_json_excel_batch(
+            client, semaphore, pairs, prompt, check_json.new_request_batch
+        )
+    return asyncio.run(run())
+
+
+def test_batch_answer_is_split_on_pair_headers(tmp_path):
+    client = FakeBedrockClient()
+    diffs = run_batch(client, make_pairs(tmp_path, 2), make_prompt())
+
+    assert diffs == ["- diff 1", "- diff 2"]
+    assert len(client.calls) == 1
+
+
+def test_truncated_batch_is_retried_in_halves_from_the_bare_prefix(tmp_path):
+    client = FakeBedrockClient()
+    prompt = make_prompt()
+    diffs = run_batch(client, make_pairs(tmp_path, 4), prompt)
+
+    assert diffs == ["- diff 1", "- diff 2", "- diff 1", "- diff 2"]
+    assert len(client.calls) == 3
+    for messages in client.calls:
+        assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+    for messages in client.calls[1:]:
+        assert messages[-1]["content"][0]["text"].count("### PAIR") == 2
+    assert prompt == make_prompt()